@@ -1,31 +1,49 @@
+import io
 import logging
+import signal
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Optional
 
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import requests
 import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
-from pydantic import BaseModel
-
 with open('config.yaml', 'r') as f:
-    config = yaml.safe_load(f)
+    # Use libyaml based loader when PyYAML is built with it.
+    config = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
 PROJECT_ID = config['PROJECT_ID']
 DATASET_NAME = config['DATASET_NAME']
 TABLE_STATIONS = config['TABLE_STATIONS']
 TABLE_MEASUREMENTS = config['TABLE_MEASUREMENTS']
 JSON_KEY_BQ = config['JSON_KEY_BQ']
+# Missing or empty value in config.yaml means no batching.
+UPLOAD_BATCH_HOURS = config.get('UPLOAD_BATCH_HOURS')
+if UPLOAD_BATCH_HOURS is None:
+    UPLOAD_BATCH_HOURS = 1
+if isinstance(UPLOAD_BATCH_HOURS, str) and UPLOAD_BATCH_HOURS.strip().isdigit():
+    UPLOAD_BATCH_HOURS = int(UPLOAD_BATCH_HOURS)
+if isinstance(UPLOAD_BATCH_HOURS, bool) or not isinstance(UPLOAD_BATCH_HOURS, int) or UPLOAD_BATCH_HOURS < 1:
+    raise ValueError(f"UPLOAD_BATCH_HOURS must be an integer of at least 1, got: {UPLOAD_BATCH_HOURS!r}")
 KEY_PATH = f"{JSON_KEY_BQ}"
 CREDENTIALS = service_account.Credentials.from_service_account_file(
     KEY_PATH,
     scopes=["https://www.googleapis.com/auth/cloud-platform"],
 )
 CLIENT = bigquery.Client(credentials=CREDENTIALS, project=CREDENTIALS.project_id,)
+DATASET_REF = CLIENT.dataset(DATASET_NAME)
+TABLE_STATIONS_REF = DATASET_REF.table(TABLE_STATIONS)
+TABLE_MEASUREMENTS_REF = DATASET_REF.table(TABLE_MEASUREMENTS)
 TABLE_STATIONS_SCHEMA = [
     bigquery.SchemaField("id", "INTEGER"),
     bigquery.SchemaField("stationName", "STRING"),
@@ -43,105 +61,160 @@ TABLE_MEASUREMENTS_SCHEMA = [
     bigquery.SchemaField("datetime", "DATETIME"),
     bigquery.SchemaField("value", "FLOAT"),
 ]
+# Measurement rows as collected from GIOS API, dates are parsed after building the table.
+MEASUREMENT_ROWS_ARROW_SCHEMA = pa.schema([
+    pa.field("station_id", pa.int64()),
+    pa.field("sensor_id", pa.int64()),
+    pa.field("param_code", pa.string()),
+    pa.field("datetime", pa.string()),
+    pa.field("value", pa.float64()),
+])
+STATIONS_REFRESH_HOURS = 24  # How often list of station ids is downloaded again
+MAX_PENDING_PULLS = UPLOAD_BATCH_HOURS + 24  # Hourly pulls kept while uploads fail, the oldest are dropped
+MAX_WORKERS = 32  # Number of concurrent requests to GIOS API
+REQUEST_TIMEOUT = (5, 30)  # Connect and read timeout in seconds
+# Shared session to reuse connections to GIOS API between requests.
+SESSION = requests.Session()
+SESSION.mount(
+    'https://',
+    HTTPAdapter(
+        pool_connections=MAX_WORKERS,
+        pool_maxsize=MAX_WORKERS,
+        max_retries=Retry(
+            total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET']
+        ),
+    ),
+)
+SESSION.headers.update({'Accept': 'application/json'})
+# Set on SIGTERM/SIGINT, the main loop stops between steps and flushes buffered measurements.
+STOP_EVENT = threading.Event()
 
 logging.basicConfig(
     filename='app.log', level=logging.INFO,
     format='%(asctime)s %(levelname)s %(message)s'
 )
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-console.setFormatter(formatter)
-logging.getLogger('').addHandler(console)
 
 
-def create_dataset(client, dataset_name):
+def request_stop(signum, frame):
     """
-    Creates a BigQuery dataset with the specified name in the specified client's project.
+    Signal handler asking the main loop to stop after the current step.
 
     Args:
-        client: A `bigquery.Client` object representing the BigQuery client to use.
-        dataset_name: A string representing the name of the dataset to create.
+        signum: Number of the received signal.
+        frame: Current stack frame.
 
     Returns:
-        None
+        None.
+    """
+    logging.info("Received signal %d, stopping.", signum)
+    STOP_EVENT.set()
 
-    Raises:
-        google.api_core.exceptions.NotFound: If the dataset is not found.
+
+def create_dataset(client, dataset_ref):
     """
-    # Construct the dataset reference object.
-    dataset_ref = client.dataset(dataset_name)
+    Creates a BigQuery dataset with the specified reference in the specified client's project.
 
-    # Check if the dataset exists, and create it if it doesn't.
-    try:
-        client.get_dataset(dataset_ref)
-        logging.info("Dataset exists: {}.{}".format(client.project, dataset_ref.dataset_id))
-    except NotFound:
-        dataset = bigquery.Dataset(dataset_ref)
-        dataset.location = "EU"  # Set the location to your preferred location.
-        client.create_dataset(dataset)
-        logging.info("Created dataset: {}.{}".format(client.project, dataset_ref.dataset_id))
+    Args:
+        client: A `bigquery.Client` object representing the BigQuery client to use.
+        dataset_ref: A `bigquery.DatasetReference` object of the dataset to create.
+
+    Returns:
+        None
+    """
+    # Create the dataset if it doesn't exist, in a single request.
+    dataset = bigquery.Dataset(dataset_ref)
+    dataset.location = "EU"  # Set the location to your preferred location.
+    client.create_dataset(dataset, exists_ok=True)
+    logging.info("Dataset ready: %s.%s", client.project, dataset_ref.dataset_id)
 
 
-def create_table(client, dataset_name, table_name, table_schema):
+def create_table(client, table_ref, table_schema):
     """
     Creates a new table in a BigQuery dataset if it doesn't already exist.
 
     Args:
         client: A BigQuery client instance.
-        dataset_name: Name of the dataset to create the table in.
-        table_name: Name of the table to create.
+        table_ref: Reference of the table to create.
         table_schema: Schema of the table to create.
 
     Raises:
         google.api_core.exceptions.NotFound: If the dataset doesn't exist.
 
     Returns:
-        None.
+        bigquery.Table: The created or already existing table.
     """
-    # Construct the dataset reference object.
-    dataset_ref = client.dataset(dataset_name)
-    dataset = bigquery.Dataset(dataset_ref)
-    dataset.location = "EU"
+    # Create the table if it doesn't exist, in a single request.
+    table = client.create_table(bigquery.Table(table_ref, schema=table_schema), exists_ok=True)
+    logging.info("Table ready: %s.%s.%s", client.project, table_ref.dataset_id, table.table_id)
 
-    # Construct the table measurement reference object.
-    table_ref = dataset_ref.table(table_name)
-
-    # Check if the table exists, and create it if it doesn't.
-    try:
-        client.get_table(table_ref)
-        logging.info("Table exists: {}.{}.{}".format(client.project, dataset.dataset_id, table_name))
-    except NotFound:
-        table = bigquery.Table(table_ref, schema=table_schema)
-        table = client.create_table(table)
-        logging.info("Created table: {}.{}.{}".format(client.project, dataset.dataset_id, table.table_id))
+    return table
 
 
-def upload_dataframe_to_bq(client, dataset_name, table_name, df):
+def upload_dataframe_to_bq(client, table_ref, df):
     """
     Uploads a Pandas DataFrame to a BigQuery table.
 
     Args:
         client: A BigQuery client object.
-        dataset_name: The name of the dataset in which to create the table.
-        table_name: The name of the table to create.
+        table_ref: The reference of the table to upload to.
         df: The Pandas DataFrame to upload.
 
     Returns:
         None.
     """
-    # Construct the dataset reference object.
-    dataset_ref = client.dataset(dataset_name)
-
-    # Construct the table reference object.
-    table_ref = dataset_ref.table(table_name)
-
     # Upload the DataFrame to the table.
     job_config = bigquery.LoadJobConfig()
     job = client.load_table_from_dataframe(df, table_ref, job_config=job_config)
     job.result()
 
 
+def upload_arrow_table_to_bq(client, table_ref, table_schema, table):
+    """
+    Uploads a PyArrow Table to a BigQuery table as Parquet file, without converting it to Pandas.
+
+    Args:
+        client: A BigQuery client object.
+        table_ref: The reference of the table to upload to.
+        table_schema: Schema of the table to upload to.
+        table: The PyArrow Table to upload.
+
+    Returns:
+        None.
+    """
+    # Serialize the table to Parquet in memory.
+    buffer = pa.BufferOutputStream()
+    pq.write_table(table, buffer, compression='snappy')
+
+    # Upload the Parquet file to the table.
+    job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET, schema=table_schema)
+    job = client.load_table_from_file(io.BytesIO(buffer.getvalue().to_pybytes()), table_ref, job_config=job_config)
+    job.result()
+
+
+def upload_measurement_tables(client, tables: List[pa.Table]) -> bool:
+    """
+    Uploads buffered hourly measurement tables to the measurements table in one load job.
+
+    Args:
+        client: A BigQuery client object.
+        tables: Measurement tables built by `measurement_rows_to_arrow`.
+
+    Returns:
+        bool: True if tables were uploaded (or there was nothing to upload), False if the load job failed.
+    """
+    table = pa.concat_tables(tables) if tables else None
+    if table is None or not table.num_rows:
+        return True
+    try:
+        upload_arrow_table_to_bq(client, TABLE_MEASUREMENTS_REF, TABLE_MEASUREMENTS_SCHEMA, table)
+    except Exception as e:
+        logging.error("Error to uploading %d measurement rows, keeping them for next upload: %s", table.num_rows, e)
+        return False
+    logging.info("Uploaded %d measurement rows.", table.num_rows)
+
+    return True
+
+
 def get_station_info() -> pd.DataFrame:
     """
     Retrieves information about air quality monitoring stations in Poland from the GIOŚ API.
@@ -149,116 +222,258 @@ def get_station_info() -> pd.DataFrame:
     Returns:
         pandas.DataFrame: A dataframe containing information about each monitoring station, including its
         ID, name, geographical coordinates, address, district, province, and city.
+
+    Raises:
+        requests.exceptions.RequestException: If stations information can't be retrieved after retries.
+        ValueError: If the response body is not valid JSON.
+        Exception: Any other error (e.g. KeyError, TypeError, AttributeError) if the stations information
+            has unexpected structure.
     """
     all_stations_url = 'https://api.gios.gov.pl/pjp-api/rest/station/findAll'
-    response = requests.get(all_stations_url)
-
-    if response.status_code == 200:
-        data = response.json()
-        logging.info(f"Data captured. "
-                     f"URL: {all_stations_url}."
-                     f"Status code: {response.status_code}.")
-    else:
-        logging.error(f"Error to getting stations information from: {all_stations_url}."
-                      f"Status code: {response.status_code}")
-
-    station_info_df = pd.DataFrame(data)
-    station_info_df['district_name'] = station_info_df['city'].apply(lambda x: x['commune']['districtName'])
-    station_info_df['province'] = station_info_df['city'].apply(lambda x: x['commune']['provinceName'].capitalize())
-    station_info_df['city'] = station_info_df['city'].apply(lambda x: x['commune']['communeName'].capitalize())
-    # Convert string to float.
-    station_info_df['gegrLat'] = station_info_df['gegrLat'].apply(lambda x: float(x))
-    station_info_df['gegrLon'] = station_info_df['gegrLon'].apply(lambda x: float(x))
+    try:
+        response = SESSION.get(all_stations_url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logging.error("Error to getting stations information from: %s: %s", all_stations_url, e)
+        raise
+    data = orjson.loads(response.content)
+    logging.info("Data captured. URL: %s. Status code: %d.", all_stations_url, response.status_code)
+
+    # Extract nested city information and convert coordinates to float in a single pass.
+    for station in data:
+        commune = station['city']['commune']
+        station['district_name'] = commune['districtName']
+        station['province'] = commune['provinceName'].capitalize()
+        station['city'] = commune['communeName'].capitalize()
+        station['gegrLat'] = float(station['gegrLat'])
+        station['gegrLon'] = float(station['gegrLon'])
+
+    # Keep only columns used in stations table.
+    station_info_df = pd.DataFrame(data, columns=[field.name for field in TABLE_STATIONS_SCHEMA])
 
     return station_info_df
 
 
-def get_measurement_data(station_ids: List[int]) -> pd.DataFrame:
+def fetch_sensors(station_id: int) -> Optional[List[dict]]:
     """
-    Retrieves air quality measurement data from the API and returns a Pandas DataFrame.
+    Retrieves the list of sensors installed on a single station.
 
     Args:
-        station_ids: List of stations ids.
+        station_id: Id of the station.
 
     Returns:
-    - pd.DataFrame: A DataFrame containing the air quality measurement data.
+        Optional[List[dict]]: Sensors of the station, or None if the request failed.
     """
-    measurement_df = pd.DataFrame(
-        columns=[
-            'station_id', 'sensor_id', 'param_code', 'datetime', 'value'
-        ]
-    )
+    try:
+        response = SESSION.get(
+            f'https://api.gios.gov.pl/pjp-api/rest/station/sensors/{station_id}', timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    except Exception as e:
+        logging.error("Get error when trying to get informations for station id: %s: %s", station_id, e)
+        return None
+
+
+def fetch_sensor_data(sensor_id: int) -> Optional[dict]:
+    """
+    Retrieves the latest measurements of a single sensor.
+
+    Args:
+        sensor_id: Id of the sensor.
+
+    Returns:
+        Optional[dict]: Sensor measurements, or None if the request failed.
+    """
+    try:
+        response = SESSION.get(
+            f'https://api.gios.gov.pl/pjp-api/rest/data/getData/{sensor_id}', timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    except Exception as e:
+        logging.error("Get error when trying to get measurements for sensor id: %s: %s", sensor_id, e)
+        return None
 
-    class Measurement(BaseModel):
-        station_id: Optional[int]
-        sensor_id: Optional[int]
-        param_code: Optional[str]
-        datetime: Optional[datetime]
-        value: Optional[float]
 
-    for station_num in station_ids:
+def fetch_measurement_row(station_id: int, sensor: dict) -> Optional[dict]:
+    """
+    Retrieves the latest measurement of a single sensor as a row of the measurements table.
+
+    Args:
+        station_id: Id of the station the sensor is installed on.
+        sensor: Sensor information as returned by `fetch_sensors`.
+
+    Returns:
+        Optional[dict]: Measurement row with raw date string, or None if there is no valid measurement.
+    """
+    try:
+        sensor_id = sensor['id']
+        param_code = sensor['param']['paramCode']
+        if not isinstance(sensor_id, int):
+            raise TypeError(f"sensor id is not an integer: {sensor_id!r}")
+    except (KeyError, TypeError) as e:
+        logging.error("Get invalid sensor information for station id: %s: %s", station_id, e)
+        return None
+
+    sensor_measurement = fetch_sensor_data(sensor_id)
+    if sensor_measurement is None:
+        return None
+    try:
+        # Get latest measurement which is not None.
+        measure_value = next((v for v in sensor_measurement['values'] if v.get('value') is not None), None)
+        if measure_value is None:
+            logging.info(
+                "There is no any measure for station_id: %s, sensor_id: %s, param: %s",
+                station_id, sensor_id, param_code
+            )
+            return None
+        # Drop readings which can't be stored in the measurements table, dates are checked in bulk later.
+        value = measure_value['value']
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not isinstance(measure_value['date'], str):
+            logging.error(
+                "Get invalid measurement for sensor id: %s, localised on station id: %s: %s",
+                sensor_id, station_id, measure_value
+            )
+            return None
+
+        return {
+            'station_id': station_id,
+            'sensor_id': sensor_id,
+            'param_code': param_code,
+            'datetime': measure_value['date'],
+            'value': value,
+        }
+    except (KeyError, TypeError, AttributeError) as e:
+        logging.error(
+            "Get invalid measurements for sensor id: %s, localised on station id: %s: %s", sensor_id, station_id, e
+        )
+        return None
+
+
+def get_measurement_rows(station_ids: List[int]) -> List[dict]:
+    """
+    Retrieves the latest air quality measurement of each sensor from the API.
+
+    Requests are fanned out over a thread pool: sensors of every station are requested at once,
+    and data of each sensor is requested as soon as sensors of its station are known.
+    When `STOP_EVENT` is set, requests not started yet are cancelled and collected rows are returned.
+
+    Args:
+        station_ids: List of stations ids.
+
+    Returns:
+        List[dict]: Measurement rows with raw date strings as returned by the API.
+    """
+    rows: List[dict] = []
+    sensor_futures = []
+
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    try:
         # Get all used sensors in each station.
-        try:
-            sensors_info = requests.get(f'https://api.gios.gov.pl/pjp-api/rest/station/sensors/{station_num}').json()
-        except Exception as e:
-            logging.error(f"Get error when trying to get informations for station id: {station_num}: {e}")
-        for sensor in sensors_info:
-            param_code = sensor['param']['paramCode']
-            sensor_id = sensor['id']
-            try:
-                sensor_measurement = requests.get(
-                    f'https://api.gios.gov.pl/pjp-api/rest/data/getData/{sensor_id}'
-                ).json()
-            except Exception as e:
-                logging.error(f"Get error when trying to get measurements for sensor id: {sensor_id}, "
-                              f"localised on station id: {station_num}: {e}")
-            # Get single measurement.
-            values = sensor_measurement['values']
-            if values:
-                iter_value = iter(values)
-                # Checking if there is not None value.
-                while True:
-                    try:
-                        measure_value = next(iter_value)
-                        if measure_value['value']:
-                            break
-                    except StopIteration:
-                        break
-                single_measure = Measurement(
-                    **{
-                        'station_id': station_num,
-                        'sensor_id': sensor_id,
-                        'param_code': param_code,
-                        'datetime': datetime.strptime(measure_value['date'], '%Y-%m-%d %H:%M:%S'),
-                        'value': measure_value['value'],
-                    }
-                )
-            else:
-                logging.info(
-                    f"There is no any measure for "
-                    f"station_id: {station_num}, "
-                    f"sensor_id: {sensor_id}, "
-                    f"param: {param_code}"
-                )
-
-            new_row = pd.DataFrame(single_measure.dict(), index=[0])
-            measurement_df = measurement_df._append(new_row, ignore_index=True)
-
-    return measurement_df
+        station_futures = {executor.submit(fetch_sensors, station_num): station_num for station_num in station_ids}
+        for station_future in as_completed(station_futures):
+            if STOP_EVENT.is_set():
+                return rows
+            sensors_info = station_future.result()
+            if sensors_info is None:
+                continue
+            station_num = station_futures[station_future]
+            # Get measurements of each sensor without waiting for the remaining stations.
+            for sensor in sensors_info:
+                sensor_futures.append(executor.submit(fetch_measurement_row, station_num, sensor))
+        for sensor_future in as_completed(sensor_futures):
+            if STOP_EVENT.is_set():
+                return rows
+            row = sensor_future.result()
+            if row is not None:
+                rows.append(row)
+    finally:
+        # Don't wait for queued requests, when stopping only requests in progress are finished.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return rows
+
+
+def measurement_rows_to_arrow(rows: List[dict]) -> pa.Table:
+    """
+    Builds a PyArrow Table matching the measurements table schema from measurement rows.
+
+    Rows with a date which can't be parsed are dropped.
+
+    Args:
+        rows: Measurement rows returned by `get_measurement_rows`.
+
+    Returns:
+        pa.Table: A table containing the air quality measurement data.
+    """
+    table = pa.Table.from_pylist(rows, schema=MEASUREMENT_ROWS_ARROW_SCHEMA)
+    # Parse all dates at once, invalid dates become null.
+    datetime_index = table.schema.get_field_index('datetime')
+    table = table.set_column(
+        datetime_index, 'datetime',
+        pc.strptime(table['datetime'], format='%Y-%m-%d %H:%M:%S', unit='us', error_is_null=True)
+    )
+    invalid_dates = table['datetime'].null_count
+    if invalid_dates:
+        logging.error("Dropped %d measurements with invalid date.", invalid_dates)
+        table = table.filter(pc.is_valid(table['datetime']))
+
+    return table
 
 
 if __name__ == '__main__':
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    console.setFormatter(formatter)
+    logging.getLogger('').addHandler(console)
+    # Stop on `docker stop` and Ctrl+C between steps, so buffered measurements are flushed.
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
     # Trying to create dataset and tables.
-    create_dataset(CLIENT, DATASET_NAME)
-    create_table(CLIENT, DATASET_NAME, TABLE_STATIONS, TABLE_STATIONS_SCHEMA)
-    create_table(CLIENT, DATASET_NAME, TABLE_MEASUREMENTS, TABLE_MEASUREMENTS_SCHEMA)
+    create_dataset(CLIENT, DATASET_REF)
+    table = create_table(CLIENT, TABLE_STATIONS_REF, TABLE_STATIONS_SCHEMA)
+    create_table(CLIENT, TABLE_MEASUREMENTS_REF, TABLE_MEASUREMENTS_SCHEMA)
     # Uploading stations info not exists
-    table_ref = CLIENT.dataset(DATASET_NAME).table(TABLE_STATIONS)
-    table = CLIENT.get_table(table_ref)
+    station_info_df = get_station_info()
     # Check if the table of stations info is empty.
     if not table.num_rows:
-        upload_dataframe_to_bq(CLIENT, DATASET_NAME, TABLE_STATIONS, get_station_info())
-    # Uploading measurements every hour.
-    while True:
-        upload_dataframe_to_bq(CLIENT, DATASET_NAME, TABLE_MEASUREMENTS, get_measurement_data(get_station_info()['id']))
-        time.sleep(3600)
+        upload_dataframe_to_bq(CLIENT, TABLE_STATIONS_REF, station_info_df)
+    # Station ids change rarely, so they are refreshed once a day only.
+    station_ids = station_info_df['id'].tolist()
+    iter_count = 0
+    # Collecting measurements every hour and uploading them in batches of hourly pulls.
+    pending_tables = []
+    next_tick = time.monotonic()
+    while not STOP_EVENT.is_set():
+        if iter_count and iter_count % STATIONS_REFRESH_HOURS == 0:
+            # Keep previous station ids if they can't be refreshed.
+            try:
+                station_ids = get_station_info()['id'].tolist()
+            except Exception as e:
+                logging.error("Station ids not refreshed, keeping %d previous ids: %s", len(station_ids), e)
+        # Measurements are validated when collected, so only failed load jobs are retried.
+        measurement_rows = get_measurement_rows(station_ids)
+        try:
+            pending_tables.append(measurement_rows_to_arrow(measurement_rows))
+        except Exception as e:
+            logging.error("Dropped %d measurement rows, can't build table: %s", len(measurement_rows), e)
+        if len(pending_tables) > MAX_PENDING_PULLS:
+            dropped_table = pending_tables.pop(0)
+            logging.error("Dropped %d measurement rows of the oldest not uploaded pull.", dropped_table.num_rows)
+        # Tables which failed to upload are kept and retried with the next pull.
+        if len(pending_tables) >= UPLOAD_BATCH_HOURS and upload_measurement_tables(CLIENT, pending_tables):
+            pending_tables = []
+        iter_count += 1
+        # Sleep until the next full hour since the start, so the time of work doesn't add up.
+        next_tick += 3600
+        sleep_for = next_tick - time.monotonic()
+        if sleep_for > 0:
+            STOP_EVENT.wait(sleep_for)
+        else:
+            next_tick = time.monotonic()
+    # Flush measurements which are still waiting for the batch to fill up.
+    remaining_tables, pending_tables = pending_tables, []
+    upload_measurement_tables(CLIENT, remaining_tables)
+    logging.info("Stopped.")